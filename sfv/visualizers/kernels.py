@@ -0,0 +1,124 @@
+"""Numeric kernels of the visualizers.
+
+The kernels are compiled with Numba if it is installed.
+Otherwise, the equivalent NumPy implementations are used.
+"""
+
+import numpy as np
+
+try:
+    from numba import njit
+    from numba import prange
+except ImportError:  # Numba is an optional dependency.
+    njit = None
+    prange = range
+
+
+def _blend_colors_numpy(acts, arr_t, color_white, delta_up, delta_dn, out):
+    """Blend the node colors from white according to the activities.
+
+    Args:
+        acts (numpy.ndarray): Activities of N nodes.
+        arr_t (numpy.ndarray): Blending ratios of the nodes in [0, 1].
+        color_white (numpy.ndarray): RGB color for zero activity.
+        delta_up (numpy.ndarray): color_up - color_white,
+            where color_up is for positive activities.
+        delta_dn (numpy.ndarray): color_dn - color_white,
+            where color_dn is for non-positive activities.
+        out (numpy.ndarray): (N, 3) integer buffer for the RGB colors.
+
+    Returns:
+        out filled with the rounded RGB colors.
+    """
+    deltas = np.where((acts > 0)[:, None], delta_up, delta_dn)
+    np.copyto(out,
+              np.rint(color_white + arr_t[:, None] * deltas),
+              casting='unsafe')
+    return out
+
+
+def _blend_colors_numba(acts, arr_t, color_white, delta_up, delta_dn, out):
+    for i in range(acts.shape[0]):
+        delta = delta_up if acts[i] > 0 else delta_dn
+        for c in range(3):
+            out[i, c] = int(np.rint(color_white[c] + arr_t[i] * delta[c]))
+    return out
+
+
+def _edge_arrays_numpy(log_f, f_vals, a_vals,
+                       flow_min, flow_max, flow_thr,
+                       lw_min, lw_max):
+    """Compute the widths, head kinds, and flow signs of edges.
+
+    Args:
+        log_f (numpy.ndarray): Log10 of the absolute flows of E edges.
+        f_vals (numpy.ndarray): Signal flows of the edges.
+        a_vals (numpy.ndarray): Nonzero adjacency values of the edges.
+        flow_min (float): Minimum of log10 of the nonzero absolute flows.
+        flow_max (float): Maximum of log10 of the nonzero absolute flows.
+        flow_thr (float): Log10 flow at which the width saturates.
+        lw_min (float): Minimum edge width, also used for zero flows.
+        lw_max (float): Maximum edge width.
+
+    Returns:
+        widths ((E,) numpy.ndarray): Edge widths.
+        kinds ((E,) numpy.ndarray): 1 for a positive head and -1 for
+            a negative head, which follows the sign of the flow or
+            that of the edge if the flow is zero.
+        signs ((E,) numpy.ndarray): Signs of the flows (-1, 0, or 1).
+    """
+    signs = np.sign(f_vals).astype(np.int8)
+    nz = signs != 0
+    kinds = np.where(nz, signs, np.sign(a_vals)).astype(np.int8)
+
+    span = flow_max - flow_min
+    span_zero = span == 0
+    mid_w = 0.5 * (lw_max + lw_min)
+    scale = 0.0 if span_zero else (lw_max - lw_min) / span
+
+    log_f = np.clip(log_f, a_min=flow_min, a_max=flow_thr)
+    widths = np.where(nz,
+                      np.where(span_zero, mid_w,
+                               (log_f - flow_min) * scale + lw_min),
+                      lw_min)
+    return widths, kinds, signs
+
+
+def _edge_arrays_numba(log_f, f_vals, a_vals,
+                       flow_min, flow_max, flow_thr,
+                       lw_min, lw_max):
+    n = f_vals.shape[0]
+    widths = np.empty(n)
+    kinds = np.empty(n, np.int8)
+    signs = np.empty(n, np.int8)
+
+    span = flow_max - flow_min
+    span_zero = span == 0
+    mid_w = 0.5 * (lw_max + lw_min)
+    scale = 0.0 if span_zero else (lw_max - lw_min) / span
+    for k in prange(n):
+        f = f_vals[k]
+        if f == 0:
+            signs[k] = 0
+            kinds[k] = 1 if a_vals[k] > 0 else -1
+            widths[k] = lw_min
+            continue
+
+        sign = 1 if f > 0 else -1
+        signs[k] = sign
+        kinds[k] = sign
+        if span_zero:
+            widths[k] = mid_w
+        else:
+            x = min(max(log_f[k], flow_min), flow_thr)
+            widths[k] = (x - flow_min) * scale + lw_min
+    return widths, kinds, signs
+
+
+if njit is None:
+    blend_colors = _blend_colors_numpy
+    edge_arrays = _edge_arrays_numpy
+else:
+    blend_colors = njit(cache=True, fastmath=True)(_blend_colors_numba)
+    edge_arrays = njit(cache=True, fastmath=True,
+                       parallel=True)(_edge_arrays_numba)
@@ -1,8 +1,14 @@
 from typing import Dict
+import hashlib
+from contextlib import contextmanager
 
 
 import numpy as np
 from numpy.typing import ArrayLike
+try:
+    import scipy.sparse as sp
+except ImportError:  # SciPy is optional and only needed for sparse inputs.
+    sp = None
 import networkx as nx
 
 from qtpy.QtGui import QFont
@@ -18,55 +24,186 @@ NegHead = ArrowClassFactory.create('HAMMER')
 PosHead = ArrowClassFactory.create('TRIANGLE')
 TextLabel = LabelClassFactory.create('TEXT_LABEL')
 
+_COLOR_POS = QColor(255, 10, 10, 70)
+_COLOR_NEG = QColor(10, 10, 255, 70)
+_COLOR_ZERO = QColor(100, 100, 100, 100)
+_COLOR_BORDER = QColor(40, 40, 40)
+_COLOR_ACT_TEXT = QColor(20, 20, 20)
 
-from sfv.visualizers.visualizer import Visualizer
-
-
-
-def _update_edges(net, A, F, i2n, pct_edge, lw_min, lw_max):
-    log_flows = np.log10(np.abs(F[np.array(F).nonzero()]))
-    flow_max = log_flows.max()
-    flow_min = log_flows.min()
-    flow_thr = np.percentile(log_flows, pct_edge)
-
-    ir, ic = np.array(A).nonzero()  # F.to_numpy().nonzero()
-    for i, j in zip(ir, ic):
-        tgt = i2n[i]
-        src = i2n[j]
-        f = F[i, j]
+# Lookup tables indexed by the head kind or the flow sign plus one.
+_HEAD_CLASSES = (NegHead, None, PosHead)
+_EDGE_COLORS = (_COLOR_NEG, _COLOR_ZERO, _COLOR_POS)
 
-        edge = net.nxgraph[src][tgt]['GRAPHICS']
 
+from sfv.visualizers.visualizer import Visualizer
+from sfv.visualizers.kernels import blend_colors
+from sfv.visualizers.kernels import edge_arrays
+
+
+def _to_rgb(color, default, name):
+    # Convert a color given as None (default), QColor, or
+    # a sequence of RGB values into a float32 array of shape (3,).
+    if color is None:
+        return np.asarray(default, dtype=np.float32)
+    elif isinstance(color, QColor):
+        return np.array([color.red(), color.green(), color.blue()],
+                        dtype=np.float32)
+
+    arr = np.asarray(color, dtype=np.float32)
+    if arr.shape != (3,):
+        raise ValueError("%s should be 3-dimensional np.ndarray "
+                         "or QtGui.QColor" % (name))
+    return arr
+
+
+def _issparse(x):
+    return sp is not None and sp.issparse(x)
+
+
+def _percentile(a, q):
+    """Return the q-th percentile of a (linear interpolation).
+
+    Only the two order statistics around the percentile are selected
+    with np.partition, which is O(n) and cheaper than np.percentile
+    for a single threshold. Small arrays use np.percentile directly.
+    """
+    a = np.ravel(a)
+    if a.size < 64:
+        return np.percentile(a, q)
+
+    if not 0 <= q <= 100:
+        raise ValueError("Percentiles must be in the range [0, 100]")
+
+    pos = q / 100 * (a.size - 1)
+    lo = int(pos)
+    hi = min(lo + 1, a.size - 1)
+    part = np.partition(a, (lo, hi))
+    return part[lo] + (pos - lo) * (part[hi] - part[lo])
+
+
+def _gather(M, ir, ic):
+    # Read the elements of a dense or sparse matrix at (ir, ic).
+    if _issparse(M):
+        return np.asarray(sp.csr_matrix(M)[ir, ic]).ravel()
+    return np.asarray(M)[ir, ic]
+
+
+def _lookup_edges(net, ir, ic, i2n):
+    return [net.nxgraph[i2n[j]][i2n[i]]['GRAPHICS']
+            for i, j in zip(ir, ic)]
+
+
+def _find_edges(net, A, i2n):
+    # Return the row and column indices of the edges in A, the values
+    # of A at them, and the graphics items of the edges. The indices
+    # and items are cached in the network. The indices are reused
+    # as long as the nonzero pattern of A and i2n are not changed,
+    # and the items as long as they are still the edges of the network
+    # (an edge can be replaced or removed and added again). i2n is
+    # compared by identity, which relies on _get_i2n returning a new
+    # dict whenever n2i is changed.
+    if _issparse(A):
+        A = sp.csr_matrix(A)
+        nnz = np.count_nonzero(A.data)
+    else:
+        A = np.asarray(A)
+        nnz = np.count_nonzero(A)
+
+    key = (A.shape, nnz)
+    cache = getattr(net, '_sfv_edge_cache', None)
+    if cache is not None and cache['key'] == key and cache['i2n'] is i2n:
+        ir, ic = cache['ir'], cache['ic']
+        a_vals = _gather(A, ir, ic)
+        # With the same nnz, the pattern is the same if A is still
+        # nonzero at all the cached positions.
+        if np.all(a_vals != 0):
+            net_edges = net.edges
+            if not all(net_edges.get(iden) is edge
+                       for iden, edge in zip(cache['idens'],
+                                             cache['edges'])):
+                edges = _lookup_edges(net, ir, ic, i2n)
+                cache['edges'] = edges
+                cache['idens'] = [edge.iden for edge in edges]
+            return ir, ic, a_vals, cache['edges']
+
+    # Sparse matrices are walked in CSR storage order, and dense arrays
+    # are used as they are (no copy) to locate the edges.
+    if _issparse(A):
+        rows = np.repeat(np.arange(A.shape[0]), np.diff(A.indptr))
+        stored = A.data != 0  # Explicitly stored zeros are not edges.
+        ir = rows[stored]
+        ic = A.indices[stored]
+        a_vals = A.data[stored]
+    else:
+        # nonzero() of a boolean mask takes a faster path than that of
+        # a float array, and the mask gathers the values in one pass.
+        mask = A != 0
+        ir, ic = np.nonzero(mask)
+        a_vals = A[mask]
+
+    edges = _lookup_edges(net, ir, ic, i2n)
+    net._sfv_edge_cache = {'key': key, 'i2n': i2n,
+                           'ir': ir, 'ic': ic,
+                           'edges': edges,
+                           'idens': [edge.iden for edge in edges]}
+    return ir, ic, a_vals, edges
+
+
+def _update_edges(net, A, F, i2n, pct_edge, lw_min, lw_max, fp=None):
+    ir, ic, a_vals, edges = _find_edges(net, A, i2n)
+
+    # Skip the update if the same edge items have already been updated
+    # with the same inputs (fp is the fingerprint of the inputs).
+    last = getattr(net, '_sfv_edge_fp', None)
+    if (fp is not None and last is not None
+            and last[0] == fp and last[1] is edges):
+        return
+
+    f_vals = _gather(F, ir, ic)
+
+    if f_vals.size == 0:  # There is no edge to update.
+        return
+
+    # log10|F| of the edges is computed once, and it is used for
+    # both the statistics of flows and the edge widths.
+    nz = f_vals != 0
+    log_f = np.zeros(f_vals.shape)
+    np.log10(np.abs(f_vals), out=log_f, where=nz)
+
+    log_flows = log_f[nz]
+    if log_flows.size > 0:
+        flow_max = log_flows.max()
+        flow_min = log_flows.min()
+        flow_thr = _percentile(log_flows, pct_edge)
+    else:  # All flows are zero, and every edge gets lw_min.
+        flow_max = flow_min = flow_thr = 0.0
+
+    widths, kinds, signs = edge_arrays(log_f, f_vals, a_vals,
+                                       flow_min, flow_max, flow_thr,
+                                       lw_min, lw_max)
+
+    # When flow is zero, the head shows the sign of the edge (kinds),
+    # and the edge gets the color of zero flow (signs).
+    head_classes = [_HEAD_CLASSES[k] for k in (kinds + 1).tolist()]
+    colors = [_EDGE_COLORS[k] for k in (signs + 1).tolist()]
+
+    for edge, head_class, color_edge, width in zip(edges,
+                                                   head_classes,
+                                                   colors,
+                                                   widths.tolist()):
+        # A head belongs to a single edge (it keeps the edge as its parent
+        # and is resized with it), so heads cannot be shared among edges.
+        # Replace the head only if its type has to change.
         head_old = edge.head
-        args_head = head_old.width, head_old.height, head_old.offset
-        if f > 0:
-            head = PosHead(*args_head)
-            color_edge = QColor(255, 10, 10, 70)
-        elif f < 0:
-            head = NegHead(*args_head)
-            color_edge = QColor(10, 10, 255, 70)
-        else:  # When flow is zero, show the sign of the original edge.
-            if A[i, j] > 0:
-                head = PosHead(*args_head)
-            elif A[i, j] < 0:
-                head = NegHead(*args_head)
-            else:
-                raise RuntimeError("The logic is abnormal.")
-
-            color_edge = QColor(100, 100, 100, 100)
-
-        edge.head = head
+        if type(head_old) is not head_class:
+            edge.head = head_class(head_old.width,
+                                   head_old.height,
+                                   head_old.offset)
+
         edge['FILL_COLOR'] = color_edge
+        edge.width = width
 
-        if f == 0:
-            edge.width = lw_min
-        elif (flow_max - flow_min) == 0:
-            edge.width = 0.5 * (lw_max + lw_min)
-        else:
-            log_f = np.log10(np.abs(f))
-            log_f = np.clip(log_f, a_min=flow_min, a_max=flow_thr)
-            lw = (log_f - flow_min) / (flow_max - flow_min) * (lw_max - lw_min) + lw_min
-            edge.width = lw
+    net._sfv_edge_fp = (fp, edges)
 
 
 def _update_single_label_name(net,
@@ -78,48 +215,148 @@ def _update_single_label_name(net,
     label_name = net.labels[name]
 
     lightness = QColor(node['FILL_COLOR']).lightness()
-    label_name['TEXT_COLOR'] = Qt.black
-
-    label_name['FONT'] = font
-
-    if lightness < 200:
-        label_name['TEXT_COLOR'] = Qt.white
-        label_name['FONT_BOLD'] = True
+    is_dark = lightness < 200
+
+    # Laying out the text is expensive, so the label is updated
+    # only if its text color, font, or text has been changed.
+    key = (is_dark, font.key(), label_name.text)
+    cache = getattr(label_name, '_sfv_cache', None)
+    if cache is not None and cache[0] == key:
+        width, height = cache[1]
     else:
-        label_name['TEXT_COLOR'] = Qt.black
-        label_name['FONT_BOLD'] = False
+        label_name['FONT'] = font
 
-    rect = label_name.boundingRect()
-    label_name.setPos(-rect.width() / 2, -rect.height() / 2)  # center
-    if not fix_node_size:
-        node.width = 1.1 * rect.width()
-        node.height = 1.1 * rect.height()
+        if is_dark:
+            label_name['TEXT_COLOR'] = Qt.white
+            label_name['FONT_BOLD'] = True
+        else:
+            label_name['TEXT_COLOR'] = Qt.black
+            label_name['FONT_BOLD'] = False
 
+        rect = label_name.boundingRect()
+        width, height = rect.width(), rect.height()
+        label_name.setPos(-width / 2, -height / 2)  # center
+        label_name._sfv_cache = (key, (width, height))
 
-def _update_single_label_activity(net, node, activity, fix_act_label, fmt, font):
-    iden = '%s_act' % node.iden.upper()
+    if not fix_node_size:
+        node.width = 1.1 * width
+        node.height = 1.1 * height
+
+
+def _update_single_label_activity(net,
+                                  node,
+                                  iden,
+                                  label_act,
+                                  activity,
+                                  fix_act_label,
+                                  fmt,
+                                  font):
     str_x = fmt % (activity)
-    if iden not in net.labels:
+    is_new = label_act is None
+    if is_new:
         label_act = TextLabel(node, text=str_x)
         label_act.iden = iden
     else:
-        label_act = net.labels[iden]
-        label_act.text = str_x % (activity)
+        label_act.text = str_x
 
     if not fix_act_label:
         label_act['FONT'] = font
-        label_act['TEXT_COLOR'] = QColor(20, 20, 20)
+        label_act['TEXT_COLOR'] = _COLOR_ACT_TEXT
         rect = label_act.boundingRect()
         pos_x = node.width / 2 + 0.5
         label_act.setPos(pos_x, -rect.height() / 2)
 
-    if iden not in net.labels:
+    if is_new:
         net.add_label(label_act)
 
+
+@contextmanager
+def _bulk_update(net):
+    # Block the signals of the scene and the repaints of its views
+    # while the items are updated, and then update the scene only once.
+    scene = net.scene
+    views = [view for view in scene.views() if view.updatesEnabled()]
+    blocked = scene.blockSignals(True)
+    for view in views:
+        view.setUpdatesEnabled(False)
+
+    try:
+        yield
+    finally:
+        scene.blockSignals(blocked)
+        for view in views:
+            view.setUpdatesEnabled(True)
+        scene.update()
+
+
+def _fingerprint(x):
+    # A content hash of a dense or sparse array to detect whether it has
+    # been changed between the calls, including in-place modifications.
+    h = hashlib.blake2b(digest_size=16)
+    if _issparse(x):
+        x = sp.csr_matrix(x)
+        h.update(repr(('sparse', x.shape)).encode())
+        arrays = (x.data, x.indices, x.indptr)
+    else:
+        arrays = (np.asarray(x),)
+
+    for arr in arrays:
+        arr = np.ascontiguousarray(arr)
+        h.update(repr((arr.dtype.str, arr.shape)).encode())
+        h.update(arr.data)
+    return h.digest()
+
+
+def _get_nodes(net, n2i):
+    # Return the indices, the activity label keys, and the items of
+    # the nodes sorted by their indices. The order of the nodes and
+    # the label keys are cached in the network with a copy of n2i,
+    # and the cache is rebuilt if n2i differs from the copy or the nodes
+    # are changed. The items are read from the network on every call
+    # because a node can be replaced by another item under the same iden
+    # (e.g., Network.replace_node).
+    net_nodes = net.nodes
+    key = len(net_nodes)
+    cache = getattr(net, '_sfv_node_cache', None)
+    if cache is not None and cache['key'] == key and cache['n2i'] == n2i:
+        try:
+            nodes = [net_nodes[iden] for iden in cache['idens']]
+            return cache['idx'], cache['labels'], nodes
+        except KeyError:  # A node has been removed and another added.
+            pass
+
+    idens = sorted(net_nodes, key=lambda iden: n2i[iden])
+    cache = {'n2i': dict(n2i), 'key': key, 'idens': idens,
+             'idx': np.array([n2i[iden] for iden in idens], dtype=int),
+             'labels': ['%s_act' % iden.upper() for iden in idens]}
+    net._sfv_node_cache = cache
+    nodes = [net_nodes[iden] for iden in idens]
+    return cache['idx'], cache['labels'], nodes
+
+
+def _get_i2n(net, n2i):
+    # The inverse of n2i is cached in the network with a copy of n2i,
+    # and it is rebuilt if n2i differs from the copy. n2i is compared
+    # by its contents, not by its identity, since it can be modified
+    # in place (e.g., the nodes are re-indexed).
+    cache = getattr(net, '_sfv_i2n', None)
+    if cache is None or cache[0] != n2i:
+        cache = (dict(n2i), {val: key for key, val in n2i.items()})
+        net._sfv_i2n = cache
+    return cache[1]
+
+
 class LinearVisualizer(Visualizer):
 
     def __init__(self):
-        pass
+        # Buffers for the node colors, which are reused across the calls
+        # and reallocated only if the number of nodes is changed.
+        self._arr_t = None
+        self._colors_buf = None
+        self._rgbs = None
+
+        # Fingerprint of the inputs of the node colors in self._rgbs.
+        self._node_fp = None
 
     def visualize(self,
                   net: nezzle.graphics.Network,
@@ -145,7 +382,7 @@ class LinearVisualizer(Visualizer):
             net (nezzle.graphics.Network):
                 Network object of Nezzle.
 
-            F (numpy.ndarray):
+            F (numpy.ndarray or scipy.sparse.spmatrix):
                 A matrix of signal flows.
                 It is usually calculated as W2*x1 - W1*x1,
                 where W is weight matrix and
@@ -155,7 +392,7 @@ class LinearVisualizer(Visualizer):
                 Changes in the activities, which are usually calculated
                 as x2 - x1. The x1 and x2 are the activities of different conditions.
 
-            A (numpy.ndarray):
+            A (numpy.ndarray or scipy.sparse.spmatrix):
                 Adjacency matrix of the network.
 
             n2i (dict):
@@ -163,11 +400,11 @@ class LinearVisualizer(Visualizer):
 
             color_up (numpy.ndarray or QtGui.QColor):
                 Color for up-regulated or positive signal flow.
-                Default is blue (i.e., QColor(0, 0, 255)).
+                Default is red (i.e., QColor(255, 0, 0)).
 
             color_dn (numpy.ndarray or QtGui.QColor):
                 Color for down-regulated or negative signal flow.
-                Default is red (i.e., QColor(255, 0, 0)).
+                Default is blue (i.e., QColor(0, 0, 255)).
 
             lw_min (float):
                 Minimum edge width, which is also used for unchanged flow.
@@ -210,76 +447,89 @@ class LinearVisualizer(Visualizer):
             None
         """
 
-        i2n = {val: key for key, val in n2i.items()}
-        color_white = np.array([255, 255, 255])
-
-        if not color_up:
-            color_up = np.array([255, 0, 0])
-        elif isinstance(color_up, QColor):
-            color_up = np.array([color_up.red(),
-                                 color_up.green(),
-                                 color_up.blue()])
-        else:
-            raise ValueError("color_up should be 3-dimensional np.ndarray "
-                             "or QtGui.QColor")
-
-        if not color_dn:
-            color_dn = np.array([0, 0, 255])
-        elif isinstance(color_dn, QColor):
-            color_dn = np.array([color_dn.red(),
-                                 color_dn.green(),
-                                 color_dn.blue()])
-        else:
-            raise ValueError("color_dn should be 3-dimensional np.ndarray "
-                             "or QtGui.QColor")
+        i2n = _get_i2n(net, n2i)
+        color_white = np.array([255, 255, 255], dtype=np.float32)
+        color_up = _to_rgb(color_up, (255, 0, 0), 'color_up')
+        color_dn = _to_rgb(color_dn, (0, 0, 255), 'color_dn')
 
         # Set the default font
         if not font:
             font = QFont('Arial', 10)
 
-        abs_act = np.abs(acts)
-        thr = np.percentile(abs_act, pct_act)
-        thr = 1 if thr == 0 else thr
-
-        arr_t = np.zeros_like(acts)
-
-        for i, elem in enumerate(acts):
-            t = np.clip(np.abs(elem) / thr, a_min=0, a_max=1)
-            arr_t[i] = t
-
-        for iden, node in net.nodes.items():
-            idx = n2i[iden]
-
-            if not fix_node_size:
-                radius = 20
-                node.width = node.height = radius
-
-            act = acts[idx]
-
-            if act > 0:
-                color = color_white + arr_t[idx] * (color_up - color_white)
-            elif act <= 0:
-                color = color_white + arr_t[idx] * (color_dn - color_white)
-
-            color = np.int32(color)
-            node['FILL_COLOR'] = QColor(*color)
-            node['BORDER_WIDTH'] = 2
-            node['BORDER_COLOR'] = QColor(40, 40, 40)
-
-            if show_label:
-                _update_single_label_name(net, node, node.name,
-                                          fix_node_size, font)
-
-            if show_act:
-                _update_single_label_activity(net,
-                                              node,
-                                              act,
-                                              fix_act_label,
-                                              fmt_act, font)
-            else:
-                iden_label = '%s_act' % iden.upper()
-                if iden_label in net.labels:
-                    net.remove_label(net.labels[iden_label])
-        # end of for : update nodes and labels
-
-        _update_edges(net, A, F, i2n, pct_edge, lw_min, lw_max)
+        # The node colors are blended again only if their inputs change.
+        node_fp = (_fingerprint(acts), pct_act,
+                   tuple(color_up), tuple(color_dn))
+        acts = np.asarray(acts)
+        if node_fp != self._node_fp:
+            n_nodes = acts.shape[0]
+            if self._arr_t is None or self._arr_t.shape[0] != n_nodes:
+                self._arr_t = np.empty(n_nodes, dtype=np.float32)
+                self._colors_buf = np.empty((n_nodes, 3), dtype=np.uint32)
+                self._rgbs = np.empty(n_nodes, dtype=np.uint32)
+
+            arr_t = self._arr_t
+            colors = self._colors_buf
+            rgbs = self._rgbs
+
+            np.abs(acts, out=arr_t)
+            thr = _percentile(arr_t, pct_act)
+            thr = 1 if thr == 0 else thr
+            arr_t /= thr
+            np.clip(arr_t, a_min=0, a_max=1, out=arr_t)
+
+            delta_up = color_up - color_white
+            delta_dn = color_dn - color_white
+            blend_colors(acts, arr_t, color_white, delta_up, delta_dn, colors)
+
+            # Pack the colors into opaque QRgb (0xAARRGGBB) integers.
+            colors[:, 0] <<= 16
+            colors[:, 1] <<= 8
+            np.bitwise_or.reduce(colors, axis=1, out=rgbs)
+            rgbs |= 0xFF000000
+            self._node_fp = node_fp
+
+        # The nodes are visited in the order of their indices, and the
+        # node-wise values are gathered in that order at once.
+        idx, act_label_keys, nodes = _get_nodes(net, n2i)
+        node_acts = acts[idx].tolist()
+        node_rgbs = self._rgbs[idx].tolist()
+
+        # Item updates are applied in bulk, and the scene is redrawn once.
+        with _bulk_update(net):
+            for node, iden_label, act, rgb in zip(nodes,
+                                                  act_label_keys,
+                                                  node_acts,
+                                                  node_rgbs):
+                # The size is fitted to the name label if it is shown.
+                if not fix_node_size and not show_label:
+                    radius = 20
+                    node.width = node.height = radius
+
+                node['FILL_COLOR'] = QColor.fromRgba(rgb)
+                node['BORDER_WIDTH'] = 2
+                node['BORDER_COLOR'] = _COLOR_BORDER
+
+                if show_label:
+                    _update_single_label_name(net, node, node.name,
+                                              fix_node_size, font)
+
+                label_act = net.labels.get(iden_label)
+                if show_act:
+                    _update_single_label_activity(net,
+                                                  node,
+                                                  iden_label,
+                                                  label_act,
+                                                  act,
+                                                  fix_act_label,
+                                                  fmt_act, font)
+                elif label_act is not None:
+                    net.remove_label(label_act)
+            # end of for : update nodes and labels
+
+            # The edges are updated only if the flows, the adjacency,
+            # the parameters, or the edge items have been changed
+            # since the last call.
+            edge_fp = (_fingerprint(A), _fingerprint(F),
+                       pct_edge, lw_min, lw_max)
+            _update_edges(net, A, F, i2n, pct_edge, lw_min, lw_max,
+                          fp=edge_fp)